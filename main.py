@@ -1,8 +1,13 @@
 # pip install pyautogen
+import argparse
+import asyncio
 import autogen
 import datetime
+import httpx
+import openai
 import os
 import sys
+from autogen.oai.client import OpenAIClient
 
 
 # OpenAI APIキー確認機能
@@ -17,83 +22,137 @@ def check_openai_api_key(api_key):
     return True
 
 
+# コマンドライン引数
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pro・Con・MediatorによるAI議論")
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="LLM応答をディスクにキャッシュし、同じプロンプトの再実行ではAPIを呼ばない",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="設定を表示して終了する（APIキー確認・エージェント作成・API呼び出しを行わない）",
+    )
+    return parser.parse_args()
+
+
 CFG = {
     "model": "gpt-5",
+    "api_type": "openai",
     "api_key": os.environ.get("OPENAI_API_KEY"),
+    "model_client_cls": "SharedOpenAIClient",
 }
 
-# OpenAI APIキー確認
-if not check_openai_api_key(CFG["api_key"]):
-    print("\n🔧 解決方法:")
-    print("1. OpenAIのAPIキーを取得")
-    print("2. 環境変数を設定: export OPENAI_API_KEY='your-api-key'")
-    print("3. または .env ファイルに OPENAI_API_KEY=your-api-key を記載")
-    sys.exit(1)
-
-pro = autogen.AssistantAgent(
-    name="Pro",
-    system_message=(
-        "あなたはPlan A（内製）の長所と可能性を最大化して主張する役割。Plan B（外注）の弱点とリスクを鋭く指摘する役割。"
-        "以下の前提条件を必ず考慮して議論してください："
-        "・社内エンジニア2名（業務知識有、月80h制約）"
-        "・外注先（クラウド経験豊富、業務知識なし）"
-        "・予算：初年度1,000万円・期限：半年以内にプロトタイプデモ"
-        "他の参加者の発言を受けて、さらに深い議論を展開し、反論や追加の論点を提示してください。"
-        "必ず日本語で応答してください。英語は使用しないでください。"
-    ),
-    llm_config=CFG,
+
+# 全エージェントで1つのOpenAIクライアント（HTTP接続プール）を共有するモデルクライアント
+class SharedOpenAIClient(OpenAIClient):
+    def __init__(self, config, client):
+        super().__init__(client)
+
+    def create(self, params):
+        # model_client_clsはautogen側の設定なのでAPIには渡さない
+        params = {k: v for k, v in params.items() if k != "model_client_cls"}
+        return super().create(params)
+
+
+# 共有OpenAIクライアントを作成（keep-aliveで接続を使い回す）
+def create_shared_client(cfg):
+    return openai.OpenAI(
+        api_key=cfg["api_key"],
+        base_url=cfg.get("base_url"),
+        http_client=httpx.Client(
+            limits=httpx.Limits(max_keepalive_connections=8, max_connections=16)
+        ),
+    )
+
+
+# 全エージェント共通の指示（各役割の指示の後ろに付ける）
+COMMON_PROMPT = (
+    "最初のメッセージで示された前提条件を必ず考慮して議論してください。"
+    "必ず日本語で応答してください。英語は使用しないでください。"
 )
 
-con = autogen.AssistantAgent(
-    name="Con",
-    system_message=(
-        "あなたはPlan B（外注）の長所と可能性を最大化して主張。Plan A（内製）の弱点とリスクを鋭く指摘する役割。"
-        "以下の前提条件を必ず考慮して議論してください："
-        "・社内エンジニア2名（業務知識有、月80h制約）"
-        "・外注先（クラウド経験豊富、業務知識なし）"
-        "・予算：初年度1,000万円・期限：半年以内にプロトタイプデモ"
-        "他の参加者の発言を受けて、さらに深い議論を展開し、反論や追加の論点を提示してください。"
-        "必ず日本語で応答してください。英語は使用しないでください。"
-    ),
-    llm_config=CFG,
+PRO_ROLE = (
+    "あなたはPlan A（内製）の長所と可能性を最大化して主張する役割。Plan B（外注）の弱点とリスクを鋭く指摘する役割。"
+    "他の参加者の発言を受けて、さらに深い議論を展開し、反論や追加の論点を提示してください。"
 )
 
-mediator = autogen.AssistantAgent(
-    name="Mediator",
-    system_message=(
-        "あなたは調停役。Pro（内製支持）とCon（外注支持）の主張を統合し、議論を深めていく役割です。"
-        "以下の前提条件を必ず考慮して議論してください："
-        "・社内エンジニア2名（業務知識有、月80h制約）"
-        "・外注先（クラウド経験豊富、業務知識なし）"
-        "・予算：初年度1,000万円・期限：半年以内にプロトタイプデモ"
-        "最終ラウンドでは、両者の要素を最低1つずつ残し、さらに新規要素を1つ以上加えた第三案を必ず提示。"
-        "最後は3つの箇条書き:『残した長所』『回避したリスク』『新規要素』で締める。"
-        "途中のラウンドでは、争点を整理し、さらなる論点を引き出してください。"
-        "必ず日本語で応答してください。英語は使用しないでください。"
-    ),
-    llm_config=CFG,
+CON_ROLE = (
+    "あなたはPlan B（外注）の長所と可能性を最大化して主張。Plan A（内製）の弱点とリスクを鋭く指摘する役割。"
+    "他の参加者の発言を受けて、さらに深い議論を展開し、反論や追加の論点を提示してください。"
 )
 
+MEDIATOR_ROLE = (
+    "あなたは調停役。Pro（内製支持）とCon（外注支持）の主張を統合し、議論を深めていく役割です。"
+    "最終ラウンドでは、両者の要素を最低1つずつ残し、さらに新規要素を1つ以上加えた第三案を必ず提示。"
+    "最後は3つの箇条書き:『残した長所』『回避したリスク』『新規要素』で締める。"
+    "途中のラウンドでは、争点を整理し、さらなる論点を引き出してください。"
+)
+
+
+# エージェントを作成し、共有クライアントを登録する
+def make_agent(name, role_prompt, llm_config, shared_client):
+    agent = autogen.AssistantAgent(
+        name=name,
+        system_message=role_prompt + COMMON_PROMPT,
+        llm_config=llm_config,
+    )
+    agent.register_model_client(
+        model_client_cls=SharedOpenAIClient, client=shared_client
+    )
+    return agent
+
+
 # メッセージカウンター（グローバル変数）
 message_counter = 0
 
-# UserProxyAgentを追加
-user_proxy = autogen.UserProxyAgent(
-    name="user_proxy",
-    human_input_mode="NEVER",
-    default_auto_reply="TERMINATE",
-    code_execution_config=False,
-)
+# 議論のラウンド数（1ラウンド = Pro・Conの並行発言 + Mediatorの整理）
+ROUNDS = 3
 
-# GroupChatとGroupChatManagerを設定
-groupchat = autogen.GroupChat(
-    agents=[pro, con, mediator],
-    messages=[],
-    max_round=10,  # user_proxy初期メッセージ + 3ラウンド × 3人 = 10回
-    speaker_selection_method="round_robin",
-)
 
-manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=CFG)
+# 共有履歴をエージェント視点のメッセージに変換（自分の発言はassistant扱い）
+def messages_for(agent, history):
+    return [
+        {**m, "role": "assistant" if m["name"] == agent.name else "user"}
+        for m in history
+    ]
+
+
+# エージェントの応答を履歴用のメッセージに変換
+def to_message(agent, reply):
+    content = reply if isinstance(reply, str) else (reply or {}).get("content", "")
+    return {"role": "user", "name": agent.name, "content": content or ""}
+
+
+# 履歴の末尾に追加された発言をすぐにMarkdownへ記録（発言番号 = 履歴上の位置）
+async def record_messages(filename, history, count, start_time):
+    start = len(history) - count
+    records = [
+        (i, m["name"], m["content"]) for i, m in enumerate(history[start:], start)
+    ]
+    elapsed = int((datetime.datetime.now() - start_time).total_seconds())
+    await asyncio.to_thread(flush_messages, filename, records, elapsed)
+
+
+# ラウンド進行: ProとConは互いに依存しないため並行に発言させ、Mediatorが両者を受けて整理
+async def run_debate(agents, history, filename, start_time):
+    pro, con, mediator = agents
+    for _ in range(ROUNDS):
+        pro_reply, con_reply = await asyncio.gather(
+            pro.a_generate_reply(messages=messages_for(pro, history)),
+            con.a_generate_reply(messages=messages_for(con, history)),
+        )
+        history.extend([to_message(pro, pro_reply), to_message(con, con_reply)])
+        await record_messages(filename, history, 2, start_time)
+
+        mediator_reply = await mediator.a_generate_reply(
+            messages=messages_for(mediator, history)
+        )
+        history.append(to_message(mediator, mediator_reply))
+        await record_messages(filename, history, 1, start_time)
+
 
 # 複数ラウンドの議論を開始
 topic = "新規顧客向けSaaSダッシュボード開発: Plan A 内製 vs Plan B 外注"
@@ -108,126 +167,182 @@ initial_message = f"""テーマ: {topic}
 
 {premises}
 
-3ラウンドの議論を行います。Pro、Con、Mediatorの順番で発言してください。
+{ROUNDS}ラウンドの議論を行います。各ラウンドでProとConが発言し、続いてMediatorが整理してください。
 上記の前提条件を必ず考慮して議論を進めてください。"""
 
 
-# Markdownファイルの初期化
-def initialize_markdown_file(topic, start_time):
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"debate_{timestamp}.md"
+# ヘッダーの終了情報欄の幅（バイト数）。完了時はこの範囲だけを上書きする
+HEADER_FIELD_WIDTH = 40
+
+
+# 日時の表示形式
+DATETIME_FORMAT = "%Y年%m月%d日 %H:%M:%S"
+
+
+# 経過時間を「12.3秒 (0分12秒)」形式にする
+def format_duration(duration):
+    minutes, seconds = divmod(duration.seconds, 60)
+    return f"{duration.total_seconds():.1f}秒 ({minutes}分{seconds}秒)"
+
 
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write("# AI議論セッション\n\n")
-        f.write(f"**テーマ:** {topic}\n\n")
-        f.write(f"**開始時刻:** {start_time.strftime('%Y年%m月%d日 %H:%M:%S')}\n\n")
-        f.write(
-            "**参加エージェント:** Pro (Plan A支持), Con (Plan B支持), Mediator (調停役)\n\n"
+# ヘッダー欄の値を固定幅のバイト列にする（幅を超えると次の行を上書きしてしまうためエラー）
+def pad_field(value):
+    encoded = value.encode("utf-8")
+    if len(encoded) > HEADER_FIELD_WIDTH:
+        raise ValueError(
+            f"ヘッダー欄の値が{HEADER_FIELD_WIDTH}バイトを超えています: {value!r}"
         )
-        f.write("**議論状況:** 進行中...\n\n")
-        f.write("---\n\n")
+    return encoded.ljust(HEADER_FIELD_WIDTH)
 
-    print(f"📄 議論ファイル作成: {filename}")
-    return filename
 
+# Markdownファイルの初期化（終了情報欄は空欄で確保し、そのバイト位置を返す）
+def initialize_markdown_file(topic, start_str):
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"debate_{timestamp}.md"
+    offsets = {}
+
+    header = (
+        "# AI議論セッション\n\n"
+        f"**テーマ:** {topic}\n\n"
+        f"**開始時刻:** {start_str}\n\n"
+        "**参加エージェント:** Pro (Plan A支持), Con (Plan B支持), Mediator (調停役)\n\n"
+    ).encode("utf-8")
+    parts = [header]
+    size = len(header)
+    for key, label, value in (
+        ("status", "議論状況", "進行中..."),
+        ("end_time", "終了時刻", ""),
+        ("duration", "議論時間", ""),
+        ("message_count", "総メッセージ数", ""),
+    ):
+        prefix = f"**{label}:** ".encode("utf-8")
+        offsets[key] = size + len(prefix)
+        line = prefix + pad_field(value) + b"\n\n"
+        parts.append(line)
+        size += len(line)
+    parts.append(b"---\n\n")
+
+    # ヘッダー全体を1回のwriteで書き出す
+    with open(filename, "wb") as f:
+        f.write(b"".join(parts))
 
-# リアルタイムで発言を追加
-def append_message_to_markdown(filename, speaker, content, message_count):
+    print(f"📄 議論ファイル作成: {filename}")
+    return filename, offsets
+
+
+# 発言を追記（1つの文字列に連結して1回のwriteで書き出す。elapsedは議論開始からの秒数）
+def flush_messages(filename, messages, elapsed):
+    chunks = [
+        f"## 発言 {message_count}: {speaker}\n\n"
+        f"**経過:** {elapsed}秒\n\n"
+        f"{content}\n\n"
+        "---\n\n"
+        for message_count, speaker, content in messages
+    ]
     with open(filename, "a", encoding="utf-8") as f:
-        f.write(f"## 発言 {message_count}: {speaker}\n\n")
-        f.write(f"**時刻:** {datetime.datetime.now().strftime('%H:%M:%S')}\n\n")
-        f.write(f"{content}\n\n")
-        f.write("---\n\n")
-    print(f"📝 {speaker}の発言を記録")
-
-
-# 議論開始時刻を記録
-start_time = datetime.datetime.now()
-print(f"\n🎯 議論開始: {topic}")
-print(f"⏰ 開始時刻: {start_time.strftime('%Y年%m月%d日 %H:%M:%S')}")
-print("=" * 60)
-
-# Markdownファイルを初期化
-markdown_filename = initialize_markdown_file(topic, start_time)
-
-try:
-    # 正しいAutoGenの使い方: UserProxyAgentのinitiate_chatを使用
-    chat_result = user_proxy.initiate_chat(
-        manager,
-        message=initial_message,
-        clear_history=True,
-    )
+        f.write("".join(chunks))
+    print(f"📝 {'・'.join(speaker for _, speaker, _ in messages)}の発言を記録")
 
-    # 議論完了後にメッセージをまとめて記録
-    message_count = 0
-    for msg in groupchat.messages:
-        if msg.get("name") and msg.get("name") != "user_proxy":
-            message_count += 1
-            append_message_to_markdown(
-                markdown_filename,
-                msg.get("name"),
-                msg.get("content", ""),
-                message_count,
-            )
 
-    # 議論終了時刻を記録
-    end_time = datetime.datetime.now()
-    duration = end_time - start_time
+# 議論終了時にヘッダーの終了情報欄を上書き（本文は読み直さない）
+def finalize_markdown_file(filename, offsets, end_str, duration_str, message_count):
+    fields = {
+        "status": "完了",
+        "end_time": end_str,
+        "duration": duration_str,
+        "message_count": str(message_count),
+    }
+
+    with open(filename, "r+b") as f:
+        for key, value in fields.items():
+            f.seek(offsets[key])
+            f.write(pad_field(value))
+
+    print(f"🎉 議論完了! ファイル {filename} を最終更新しました。")
 
-    # user_proxyのメッセージを除外してカウント
-    actual_message_count = sum(
-        1 for m in groupchat.messages if m.get("name") and m.get("name") != "user_proxy"
-    )
 
-    print(f"\n✅ 議論完了! 総メッセージ数: {actual_message_count}")
-    print(f"⏰ 終了時刻: {end_time.strftime('%Y年%m月%d日 %H:%M:%S')}")
-    print(
-        f"⌛ 議論時間: {duration.total_seconds():.1f}秒 ({duration.seconds // 60}分{duration.seconds % 60}秒)"
+# 議論を実行
+async def run_session(agents):
+    # 議論開始時刻を記録
+    start_time = datetime.datetime.now()
+    start_str = start_time.strftime(DATETIME_FORMAT)
+    print(f"\n🎯 議論開始: {topic}")
+    print(f"⏰ 開始時刻: {start_str}")
+    print("=" * 60)
+
+    # Markdownファイルを初期化
+    markdown_filename, header_offsets = await asyncio.to_thread(
+        initialize_markdown_file, topic, start_str
     )
 
-except Exception as e:
+    # 議論の履歴（user_proxyの初期メッセージから開始）
+    history = [{"role": "user", "name": "user_proxy", "content": initial_message}]
+
+    error = None
+    try:
+        await run_debate(agents, history, markdown_filename, start_time)
+    except Exception as e:
+        error = e
+
+    # 議論終了時刻を記録
     end_time = datetime.datetime.now()
-    duration = end_time - start_time
-    print(f"❌ 議論中にエラーが発生: {e}")
-    print(f"⌛ エラーまでの時間: {duration.total_seconds():.1f}秒")
-    print("OpenAI APIキーまたは接続を確認してください")
-
-
-# 議論終了時にファイルの最終情報を更新
-def finalize_markdown_file(filename, end_time, duration, message_count):
-    # ファイルを読み込み
-    with open(filename, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    # 「進行中...」を「完了」に変更し、終了時刻と時間を追加
-    content = content.replace("**議論状況:** 進行中...", "**議論状況:** 完了")
-
-    # ヘッダー部分に終了情報を追加
-    header_end = content.find("---\n\n")
-    if header_end != -1:
-        new_header = content[:header_end]
-        new_header += f"**終了時刻:** {end_time.strftime('%Y年%m月%d日 %H:%M:%S')}\n\n"
-        new_header += f"**議論時間:** {duration.total_seconds():.1f}秒 ({duration.seconds // 60}分{duration.seconds % 60}秒)\n\n"
-        new_header += f"**総メッセージ数:** {message_count}\n\n"
-        new_header += "---\n\n"
-
-        # ファイルを更新
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(new_header + content[header_end + 5 :])
+    end_str = end_time.strftime(DATETIME_FORMAT)
+    duration_str = format_duration(end_time - start_time)
+
+    # 先頭のuser_proxy初期メッセージ以外はすべてエージェントの発言
+    actual_message_count = len(history) - 1
+
+    if error is None:
+        print(f"\n✅ 議論完了! 総メッセージ数: {actual_message_count}")
+        print(f"⏰ 終了時刻: {end_str}")
+        print(f"⌛ 議論時間: {duration_str}")
+    else:
+        print(f"❌ 議論中にエラーが発生: {error}")
+        print(f"⌛ エラーまでの時間: {duration_str}")
+        print("OpenAI APIキーまたは接続を確認してください")
+
+    # 議論終了後にMarkdownファイルを最終更新
+    await asyncio.to_thread(
+        finalize_markdown_file,
+        markdown_filename,
+        header_offsets,
+        end_str,
+        duration_str,
+        actual_message_count,
+    )
 
-    print(f"🎉 議論完了! ファイル {filename} を最終更新しました。")
 
+# エントリーポイント（エージェント作成はドライラン・APIキー確認の後まで遅らせる）
+def main():
+    args = parse_args()
+
+    if args.dry_run:
+        print(f"🧪 ドライラン: {topic}")
+        print(f"   モデル: {CFG['model']} / ラウンド数: {ROUNDS}")
+        return
+
+    # OpenAI APIキー確認
+    if not check_openai_api_key(CFG["api_key"]):
+        print("\n🔧 解決方法:")
+        print("1. OpenAIのAPIキーを取得")
+        print("2. 環境変数を設定: export OPENAI_API_KEY='your-api-key'")
+        print("3. または .env ファイルに OPENAI_API_KEY=your-api-key を記載")
+        sys.exit(1)
+
+    # 応答キャッシュ（autogenのディスクキャッシュ .cache/）はtemperature=0か--cache指定時のみ使う
+    llm_config = {
+        **CFG,
+        "cache_seed": 41 if args.cache or CFG.get("temperature") == 0 else None,
+    }
+    shared_client = create_shared_client(llm_config)
+    agents = (
+        make_agent("Pro", PRO_ROLE, llm_config, shared_client),
+        make_agent("Con", CON_ROLE, llm_config, shared_client),
+        make_agent("Mediator", MEDIATOR_ROLE, llm_config, shared_client),
+    )
 
-# 議論終了後にMarkdownファイルを最終更新
-# user_proxyのメッセージを除外してカウント
-actual_message_count = sum(
-    1 for m in groupchat.messages if m.get("name") and m.get("name") != "user_proxy"
-)
+    asyncio.run(run_session(agents))
 
-if "end_time" in locals() and "duration" in locals():
-    finalize_markdown_file(markdown_filename, end_time, duration, actual_message_count)
-else:
-    # エラーの場合
-    end_time = datetime.datetime.now()
-    duration = end_time - start_time
-    finalize_markdown_file(markdown_filename, end_time, duration, actual_message_count)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 # pip install pyautogen
+import asyncio
 import autogen
 
 CFG = {
     "model": "lmstudio-local",  # 任意ラベル
     "api_key": "lm-studio",
+    "api_type": "openai",
     "base_url": "http://localhost:1234/v1",
     "temperature": 0.9,
     "max_tokens": 2048,
@@ -31,21 +33,48 @@ mediator = autogen.AssistantAgent(
     llm_config=CFG,
 )
 
+
+# 応答の本文を取り出す（通常の応答はstr、ツール呼び出し等はdictで返る）
+def reply_content(reply):
+    return reply if isinstance(reply, str) else reply["content"]
+
+
 # コーディネート（1ラウンド例）
 topic = "都心の主要エリアを『平日昼の自家用車通行禁止』にするべきか？"
-pro_msg = pro.generate_reply(
-    messages=[{"role": "user", "content": f"テーマ: {topic}。強く賛成の立場で論じて。"}]
-)
-con_msg = con.generate_reply(
-    messages=[{"role": "user", "content": f"テーマ: {topic}。強く反対の立場で論じて。"}]
-)
-final = mediator.generate_reply(
-    messages=[
-        {
-            "role": "user",
-            "content": f"Proの主張:\n{pro_msg['content']}\n\nConの主張:\n{con_msg['content']}\n\n統合案を出して。",
-        }
-    ]
-)
 
-print(final["content"])
+
+async def main():
+    # ProとConは互いの発言に依存しないため並行に生成し、Mediatorだけ両者を待つ
+    pro_reply, con_reply = await asyncio.gather(
+        pro.a_generate_reply(
+            messages=[
+                {
+                    "role": "user",
+                    "content": f"テーマ: {topic}。強く賛成の立場で論じて。",
+                }
+            ]
+        ),
+        con.a_generate_reply(
+            messages=[
+                {
+                    "role": "user",
+                    "content": f"テーマ: {topic}。強く反対の立場で論じて。",
+                }
+            ]
+        ),
+    )
+    pro_msg, con_msg = reply_content(pro_reply), reply_content(con_reply)
+    final = await mediator.a_generate_reply(
+        messages=[
+            {
+                "role": "user",
+                "content": f"Proの主張:\n{pro_msg}\n\nConの主張:\n{con_msg}\n\n統合案を出して。",
+            }
+        ]
+    )
+
+    print(reply_content(final))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())